@@ -4,17 +4,58 @@ Gradio application for UI element analysis with Vertex AI.
 """
 
 import gradio as gr
+import asyncio
+import atexit
+import collections
+import datetime
+import hashlib
+import html
 import io
-import json
+import logging
 import base64
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import typing
 import zlib
 import urllib.parse
 from xml.etree import ElementTree as ET
-from PIL import Image, ImageDraw
+import numpy as np
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+
+# google.generativeai, google.cloud.secretmanager and
+# google.api_core.exceptions all pull in gRPC and are slow to import; they
+# are imported on first use (see get_genai(), get_secret_manager_client()
+# and get_api_exceptions())
+genai = None
+api_exceptions = None
+
+# Optional libpng-backed PNG encoder, noticeably faster than Pillow's
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
 
-# NEW IMPORTS
-import google.generativeai as genai
-from google.cloud import secretmanager
+# Optional JIT compiler for the duplicate box suppression loop
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Optional SIMD-accelerated JSON library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Handlers are set up by main(); importing the module leaves logging untouched
+logger = logging.getLogger(__name__)
 
 # Configuration import
 try:
@@ -26,8 +67,8 @@ except ImportError:
     APP_TITLE = "AI UI/UX Analyzer"
     APP_DESCRIPTION = "Загрузите скриншот пользовательского интерфейса, и ИИ определит и пронумерует интерактивные элементы."
     MODEL_NAME = "gemini-2.5-flash-lite-preview-06-17"
-    print("⚠️  Файл config.py не найден. Используются значения по умолчанию.")
-    print("📝 Скопируйте config_example.py в config.py и заполните ваши настройки.")
+    logger.warning("⚠️  Файл config.py не найден. Используются значения по умолчанию.")
+    logger.warning("📝 Скопируйте config_example.py в config.py и заполните ваши настройки.")
 
 # This will be our system prompt
 SYSTEM_PROMPT = """
@@ -52,128 +93,111 @@ Example:
 }
 """
 
+# System prompt of multi-image (batch) requests
+SYSTEM_PROMPT_MULTI = """
+You are an expert in UI/UX design. You will receive several images of user interfaces, in order. Analyze each image separately and identify its key interactive elements.
+For each element you identify, provide its bounding box coordinates in the pixels of its own image (top-left x, top-left y, bottom-right x, bottom-right y) and a brief description of the element and its likely function.
+Number the elements of each image starting from 1.
+Respond with a JSON object containing a single key "results", which is a list with exactly one entry per image, in the order the images were given. Each entry is an object with a single key "elements", a list of objects with the keys "id" (a number starting from 1), "box" (a list of 4 integers for the coordinates) and "description" (a string). Use an empty "elements" list for an image without interactive elements.
+Example for two images:
+{
+  "results": [
+    {
+      "elements": [
+        {
+          "id": 1,
+          "box": [10, 20, 100, 50],
+          "description": "A blue button with the text 'Submit'. Likely used to send form data."
+        }
+      ]
+    },
+    {
+      "elements": []
+    }
+  ]
+}
+"""
 
 
 
+class UIElement(typing.TypedDict):
+    """Schema of one detected element in the Gemini response."""
+    id: int
+    box: list[int]
+    description: str
 
-def get_api_key(project_id, secret_id, version_id="latest"):
-    """
-    Retrieves a secret from Google Cloud Secret Manager.
-    """
-    # Create the Secret Manager client.
-    client = secretmanager.SecretManagerServiceClient()
 
-    # Build the resource name of the secret version.
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
+class UIAnalysis(typing.TypedDict):
+    """Schema of the Gemini response, enforced through response_schema."""
+    elements: list[UIElement]
 
-    # Access the secret version.
-    response = client.access_secret_version(request={"name": name})
 
-    # Return the secret payload.
-    return response.payload.data.decode("UTF-8")
+class UIBatchAnalysis(typing.TypedDict):
+    """Schema of a multi-image Gemini response, one result per image."""
+    results: list[UIAnalysis]
 
 
-def parse_drawio_diagram(file_path):
-    """
-    Parses a Draw.io diagram file (XML) to extract nodes and edges.
-    This is a placeholder and will be replaced with actual parsing logic.
-    """
-    nodes = {}
-    edges = []
-    
-    # In a real scenario, you would parse the XML file here
-    # to extract node IDs, positions, and connections.
-    # For now, we'll just return dummy data.
-    return nodes, edges
+# Decoder used to pick complete element objects out of a streamed response
+_JSON_DECODER = json.JSONDecoder()
 
-def run_agent(nodes, edges):
-    """
-    Executes the agent logic based on the parsed diagram.
-    For now, it just prints the flow.
-    """
-    # In a real scenario, you would implement the agent's logic
-    # here, using the parsed nodes and edges.
-    # For now, we'll just simulate the flow.
-    print("Agent started.")
-    # Example: Iterate through nodes and edges to simulate a simple flow
-    for node_id, node_value in nodes.items():
-        print(f"Agent visiting node {node_id} ('{node_value}').")
-        # Simulate processing time
-        import time
-        time.sleep(1)
-    print("Agent finished.")
-    return "Agent run completed following the diagram."
+# Markdown code fences the model sometimes wraps its JSON in
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.M)
 
-def create_interactive_html(image, json_data):
-    """
-    Creates an interactive HTML visualization with clear, non-blurred borders.
-    """
-    print(f"DEBUG: create_interactive_html called. Image: {image is not None}, JSON data present: {'elements' in json_data if isinstance(json_data, dict) else False}")
-    print(f"DEBUG: JSON data received (first 100 chars): {str(json_data)[:100]}")
+# Default text of the selected element field
+ELEMENT_INFO_PLACEHOLDER = "Нажмите на элемент, чтобы увидеть его описание."
 
-    if image is None or "elements" not in json_data or not isinstance(json_data.get("elements"), list):
-        print("DEBUG: Invalid input for create_interactive_html.")
-        return "<p>No elements to visualize or invalid data.</p>"
-    
-    # Convert PIL image to base64 for embedding in HTML
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    
-    # Get image dimensions (should be the target size, e.g., 1024x1024)
-    img_width, img_height = image.size
-    
-    # Create HTML with interactive areas - SHARP BORDERS for ML training
-    html_content = f"""
-    <div style="position: relative; width: {img_width}px; height: {img_height}px; margin: auto; border: 1px solid #ddd; border-radius: 8px; overflow: hidden;">
-        <img src="data:image/png;base64,{img_str}" 
-             style="position: absolute; top: 0; left: 0; width: 100%; height: 100%;" 
-             id="ui-image" />
-        <div id="overlay" style="position: absolute; top: 0; left: 0; width: 100%; height: 100%; pointer-events: none;">
-    """
-    
-    # Add interactive areas for each element using absolute pixel values
-    if isinstance(json_data.get("elements"), list):
-        for element in json_data["elements"]:
-            if "box" in element and "description" in element:
-                box = element["box"]
-                description = element["description"]
-                element_id = element.get("id", "?")
-                
-                left_px = box[0]
-                top_px = box[1]
-                width_px = box[2] - box[0]
-                height_px = box[3] - box[1]
-
-                # SHARP BORDERS - NO TRANSPARENCY for ML training
-                escaped_description = json.dumps(description)
-                html_content += f"""
-                <div class="ui-element" data-element-id="{element_id}" data-description="{description}"
-                     style="position: absolute; 
-                            left: {left_px}px; 
-                            top: {top_px}px; 
-                            width: {width_px}px; 
-                            height: {height_px}px; 
-                            border: 3px solid #00ff00; 
-                            background-color: rgba(0, 255, 0, 0.05);
-                            cursor: pointer;
-                            pointer-events: auto;
-                            border-radius: 4px;
-                            display: flex;
-                            align-items: center;
-                            justify-content: center;
-                            font-weight: bold;
-                            font-size: 16px;
-                            color: #00ff00;
-                            text-shadow: 1px 1px 2px rgba(0,0,0,0.9);"
-                     onmouseover="showTooltip(event, {escaped_description}, {element_id})"
-                     onmouseout="hideTooltip()"
-                     onclick="selectElement({element_id}, {escaped_description})">
-                    {element_id}
-                </div>
-                """
-    
-    html_content += """
+# Overlay styling of the element boxes (sharp borders for ML training)
+_ELEMENT_COLOR = "#00ff00"
+_ELEMENT_BORDER_WIDTH = 3
+_ELEMENT_BACKGROUND = "rgba(0, 255, 0, 0.05)"
+_ELEMENT_FONT_SIZE = 16
+
+# Shared style of the element boxes, added to the page once (see _STATIC_HEAD)
+_ELEMENT_STYLE = f"""
+    <style>
+        .ui-element {{
+            position: absolute;
+            border: {_ELEMENT_BORDER_WIDTH}px solid {_ELEMENT_COLOR};
+            background-color: {_ELEMENT_BACKGROUND};
+            cursor: pointer;
+            pointer-events: auto;
+            border-radius: 4px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-weight: bold;
+            font-size: {_ELEMENT_FONT_SIZE}px;
+            color: {_ELEMENT_COLOR};
+            text-shadow: 1px 1px 2px rgba(0,0,0,0.9);
+        }}
+        .ui-element:hover {{
+            background-color: rgba(0, 255, 0, 0.15);
+            border-width: 4px;
+            box-shadow: 0 0 10px rgba(0, 255, 0, 0.5);
+        }}
+        .ui-element.selected {{
+            background-color: rgba(255, 0, 0, 0.1);
+            border-width: 4px;
+            border-color: #ff0000;
+            box-shadow: 0 0 15px rgba(255, 0, 0, 0.6);
+        }}
+    </style>
+"""
+
+# printf-style template of one element box; only its position, geometry and
+# displayed id are inlined. data-element-id is the element's position in the
+# render (ids from the model may repeat or be missing), the text its id.
+# Values are passed in the order the fields appear.
+_ELEMENT_TEMPLATE = """
+        <div class="ui-element" data-element-id="%s"
+             style="left: %.3f%%; top: %.3f%%; width: %.3f%%; height: %.3f%%;">%s</div>"""
+
+_html_escape = html.escape
+
+# Tooltip and data block closing every render, built once at import.
+# The descriptions, in element order, are inserted between the two parts as JSON;
+# renders carry no code, the overlay script is loaded once (_STATIC_HEAD).
+_RENDER_TAIL_HEAD = """
         </div>
         <div id="tooltip" style="position: absolute; 
                                  background: rgba(0, 0, 0, 0.95); 
@@ -190,61 +214,65 @@ def create_interactive_html(image, json_data):
         </div>
     </div>
 
+    <script type="application/json" id="ui-desc">"""
+_RENDER_TAIL_END = "</script>"
+
+# Overlay behaviour, added to the page <head> once (gr.Blocks(head=...)).
+# Listeners are delegated from the document, so every newly rendered
+# result works without re-running any code; descriptions are re-parsed
+# only when a new render has replaced the data block.
+_OVERLAY_SCRIPT = """
     <script>
+        let descriptionsNode = null;
+        let elementsData = [];
         let selectedElementId = null;
         let gradioSelectedText = null;
 
-        function showTooltip(event, description, elementId) {
+        function getElementsData() {
+            const node = document.getElementById('ui-desc');
+            if (node !== descriptionsNode) {
+                // A new result was rendered: parse its descriptions, drop the old selection
+                descriptionsNode = node;
+                elementsData = node ? JSON.parse(node.textContent) : [];
+                selectedElementId = null;
+                gradioSelectedText = null;
+            }
+            return elementsData;
+        }
+
+        function showTooltip(element) {
+            // Descriptions are looked up by position; the box text is the displayed id
+            const elementId = element.textContent;
+            const description = getElementsData()[element.dataset.elementId];
             const tooltip = document.getElementById('tooltip');
-            tooltip.innerHTML = `<strong>Элемент ${elementId}:</strong><br>${description}`;
+            // Model text is inserted as text nodes, never parsed as HTML
+            const title = document.createElement('strong');
+            title.textContent = `Элемент ${elementId}:`;
+            tooltip.replaceChildren(title, document.createElement('br'), description);
             tooltip.style.display = 'block';
             
-            // Position tooltip near cursor
-            const rect = event.currentTarget.getBoundingClientRect();
-            const container = event.currentTarget.closest('div[style*="position: relative"]');
-            if (!container) return;
-            const containerRect = container.getBoundingClientRect();
+            // Position tooltip next to the element
+            const rect = element.getBoundingClientRect();
+            const containerRect = document.getElementById('interactive-container').getBoundingClientRect();
             
             tooltip.style.left = (rect.left - containerRect.left + rect.width + 10) + 'px';
             tooltip.style.top = (rect.top - containerRect.top) + 'px';
-
-            // Enhanced hover effect with sharp borders
-            if (elementId !== selectedElementId) {
-                event.currentTarget.style.backgroundColor = 'rgba(0, 255, 0, 0.15)';
-                event.currentTarget.style.borderWidth = '4px';
-                event.currentTarget.style.borderColor = '#00ff00';
-                event.currentTarget.style.boxShadow = '0 0 10px rgba(0, 255, 0, 0.5)';
-            }
+            // Hover highlight is handled by the .ui-element:hover CSS rule
         }
         
         function hideTooltip() {
             const tooltip = document.getElementById('tooltip');
-            tooltip.style.display = 'none';
-            
-            // Remove hover highlight if not selected
-            const elements = document.querySelectorAll('.ui-element');
-            elements.forEach(el => {
-                const id = parseInt(el.textContent.trim());
-                if (id !== selectedElementId) {
-                    el.style.backgroundColor = 'rgba(0, 255, 0, 0.05)';
-                    el.style.borderWidth = '3px';
-                    el.style.borderColor = '#00ff00';
-                    el.style.boxShadow = 'none';
-                }
-            });
+            if (tooltip) tooltip.style.display = 'none';
         }
         
-        function selectElement(elementId, description) {
+        function selectElement(element) {
+            const position = element.dataset.elementId;
+            const elementId = element.textContent;
+            const description = getElementsData()[position];
             // Clear previous selection
-            const elements = document.querySelectorAll('.ui-element');
-            elements.forEach(el => {
-                el.style.backgroundColor = 'rgba(0, 255, 0, 0.05)';
-                el.style.borderWidth = '3px';
-                el.style.borderColor = '#00ff00';
-                el.style.boxShadow = 'none';
-            });
-
-            if (selectedElementId === elementId) {
+            document.querySelectorAll('.ui-element.selected').forEach(el => el.classList.remove('selected'));
+
+            if (selectedElementId === position) {
                 // Deselect if clicking the same element
                 selectedElementId = null;
                 gradioSelectedText = null;
@@ -252,19 +280,11 @@ def create_interactive_html(image, json_data):
                 document.dispatchEvent(new CustomEvent('elementDeselected'));
             } else {
                 // Select new element
-                selectedElementId = elementId;
+                selectedElementId = position;
                 gradioSelectedText = `Элемент ${elementId}: ${description}`;
                 
-                // Highlight selected element with sharp red border
-                const selectedEl = Array.from(elements).find(el => 
-                    parseInt(el.textContent.trim()) === elementId
-                );
-                if (selectedEl) {
-                    selectedEl.style.backgroundColor = 'rgba(255, 0, 0, 0.1)';
-                    selectedEl.style.borderWidth = '4px';
-                    selectedEl.style.borderColor = '#ff0000';
-                    selectedEl.style.boxShadow = '0 0 15px rgba(255, 0, 0, 0.6)';
-                }
+                // Highlight selected element with sharp red border (.selected CSS rule)
+                element.classList.add('selected');
                 
                 // Trigger Gradio update
                 document.dispatchEvent(new CustomEvent('elementSelected', {
@@ -273,89 +293,1119 @@ def create_interactive_html(image, json_data):
             }
         }
         
+        // One delegated listener per event type for all renders instead of
+        // handlers on every element box
+        function findElement(event) {
+            return event.target.closest ? event.target.closest('#interactive-container .ui-element') : null;
+        }
+        document.addEventListener('mouseover', event => {
+            const element = findElement(event);
+            if (element) showTooltip(element);
+        });
+        document.addEventListener('mouseout', event => {
+            const element = findElement(event);
+            if (element && !element.contains(event.relatedTarget)) hideTooltip();
+        });
+        document.addEventListener('click', event => {
+            const element = findElement(event);
+            if (element) selectElement(element);
+        });
+        
         // Function to get selected element info for Gradio
         function getSelectedElementInfo() {
             return gradioSelectedText || "Нажмите на элемент, чтобы увидеть его описание.";
         }
     </script>
+"""
+
+# Everything the result HTML needs but doesn't change between renders
+_STATIC_HEAD = _ELEMENT_STYLE + _OVERLAY_SCRIPT
+
+# Secret Manager client and the API key genai is configured with, set on first use.
+# Fetched keys are reused for API_KEY_TTL_SECONDS.
+API_KEY_TTL_SECONDS = 3600
+_SM_CLIENT = None
+_API_KEY_CACHE = {}
+_CONFIGURED_API_KEY = None
+
+# Gemini model instances (single image and batch), reused across requests
+_MODEL = None
+_BATCH_MODEL = None
+# Serializes model setup, which runs in worker threads
+_MODEL_LOCK = threading.Lock()
+
+# Server-side context cache of SYSTEM_PROMPT. The model built on it is
+# recreated shortly before the cache expires. If the cache can't be created
+# the plain system_instruction model is used instead: for good when the
+# prompt is below the model's minimum cacheable size, otherwise (transient
+# errors) until caching is tried again after CONTEXT_CACHE_RETRY_SECONDS.
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+CONTEXT_CACHE_RETRY_SECONDS = 600
+# Minimum cacheable size in tokens (Gemini 2.5 Flash models; larger for others)
+CONTEXT_CACHE_MIN_TOKENS = 1024
+_MODEL_EXPIRES_AT = None
+# Checked once, locally: even at a generous one token per 3 characters a
+# prompt below the minimum can never be cached, so no cache RPC is made
+_CONTEXT_CACHE_UNAVAILABLE = len(SYSTEM_PROMPT) / 3 < CONTEXT_CACHE_MIN_TOKENS
+
+# Per-thread buffer reused for encoding the screenshot
+_TLS = threading.local()
+
+# Rendered screenshots are written here and served by Gradio as files,
+# so the HTML only carries a URL instead of a base64 data URI
+RENDER_DIR = tempfile.mkdtemp(prefix="ui_analyzer_")
+RENDER_CACHE_SIZE = 32
+_RENDERED_FILES = collections.OrderedDict()
+_RENDER_LOCK = threading.Lock()
+_FILE_ROUTE = "/gradio_api/file=" if int(gr.__version__.split(".")[0]) >= 5 else "/file="
+atexit.register(shutil.rmtree, RENDER_DIR, ignore_errors=True)
+
+# Feedback is appended to FEEDBACK_FILE by a background writer thread
+FEEDBACK_FILE = "feedback.txt"
+_FEEDBACK_QUEUE = queue.Queue(maxsize=1000)
+_FEEDBACK_FILE_HANDLE = None
+
+# Images already uploaded through the Gemini Files API, keyed by image content.
+# Uploaded files expire after 48 hours, so entries are dropped a bit earlier.
+UPLOAD_CACHE_SIZE = 64
+UPLOAD_TTL_SECONDS = 47 * 3600
+_UPLOADED_FILES = collections.OrderedDict()
+_UPLOAD_LOCK = threading.Lock()
+
+# Retry policy of the Gemini call: malformed JSON is retried immediately,
+# transient API errors with exponential backoff
+MAX_ANALYSIS_ATTEMPTS = 3
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_GENERATION_CONFIG = {"temperature": 0.0}
+# Exception classes of transient API errors, set by get_retryable_api_errors()
+RETRYABLE_API_ERRORS = None
+
+# Longer side of the image sent to Gemini; larger screenshots are downscaled
+MAX_ANALYSIS_SIDE = 1024
+
+# Boxes overlapping an earlier box by more than this IoU are treated as duplicates
+DUPLICATE_IOU_THRESHOLD = 0.7
+
+# Analysis results of recently submitted images, keyed by image content
+ANALYSIS_CACHE_SIZE = 64
+_ANALYSIS_CACHE = collections.OrderedDict()
+_ANALYSIS_LOCK = threading.Lock()
+
+# Simulated per-node processing time of the placeholder agent, in seconds
+AGENT_STEP_DELAY_S = float(os.environ.get("AGENT_STEP_DELAY_S", "0"))
+
+# Number of analysis events Gradio runs at once; they are async and mostly
+# wait on Gemini, so this can be well above the thread count
+QUEUE_CONCURRENCY_LIMIT = int(os.environ.get("QUEUE_CONCURRENCY_LIMIT", "16"))
+
+# Smallest response body, in bytes, worth gzip-compressing
+GZIP_MINIMUM_SIZE = 1024
+
+# Micro-batching of concurrent submissions into one Gemini request.
+# Off by default so interactive use keeps streaming; set UI_ANALYZER_BATCH=1 to enable.
+BATCH_ANALYSIS = os.environ.get("UI_ANALYZER_BATCH") == "1"
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_SECONDS = 0.05
+_BATCH_QUEUE = None
+_BATCH_WORKER = None
+
+
+def get_secret_manager_client():
+    """
+    Returns the shared Secret Manager client, creating it on first use.
+    """
+    global _SM_CLIENT
+    if _SM_CLIENT is None:
+        from google.cloud import secretmanager
+        _SM_CLIENT = secretmanager.SecretManagerServiceClient()
+    return _SM_CLIENT
+
+
+def get_genai():
+    """
+    Returns the google.generativeai module, importing it on first use.
+    """
+    global genai
+    if genai is None:
+        import google.generativeai
+        genai = google.generativeai
+    return genai
+
+
+def get_api_exceptions():
+    """
+    Returns the google.api_core.exceptions module, importing it on first use.
+    """
+    global api_exceptions
+    if api_exceptions is None:
+        from google.api_core import exceptions
+        api_exceptions = exceptions
+    return api_exceptions
+
+
+def get_retryable_api_errors():
+    """
+    Returns the exception classes of transient API errors.
+    """
+    global RETRYABLE_API_ERRORS
+    if RETRYABLE_API_ERRORS is None:
+        exceptions = get_api_exceptions()
+        RETRYABLE_API_ERRORS = (
+            exceptions.ResourceExhausted,
+            exceptions.ServiceUnavailable,
+            exceptions.DeadlineExceeded
+        )
+    return RETRYABLE_API_ERRORS
+
+
+def get_api_key(project_id, secret_id, version_id="latest"):
+    """
+    Retrieves a secret from Google Cloud Secret Manager.
+    The result is cached for API_KEY_TTL_SECONDS, so the secret is fetched
+    once per hour at most while rotated secrets are still picked up.
+    """
+    cache_key = (project_id, secret_id, version_id)
+    now = time.monotonic()
+    cached = _API_KEY_CACHE.get(cache_key)
+    if cached is not None and now - cached[1] < API_KEY_TTL_SECONDS:
+        return cached[0]
+
+    # Reuse the Secret Manager client.
+    client = get_secret_manager_client()
+
+    # Build the resource name of the secret version.
+    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
+
+    # Access the secret version.
+    response = client.access_secret_version(request={"name": name})
+
+    # Cache and return the secret payload.
+    api_key = response.payload.data.decode("UTF-8")
+    _API_KEY_CACHE[cache_key] = (api_key, now)
+    return api_key
+
+
+def configure_genai():
+    """
+    Configures the genai SDK with the API key, skipping it when already done.
+    When the key has been rotated the cached models are dropped, since they
+    keep the client they were first used with.
+    """
+    global _CONFIGURED_API_KEY, _MODEL, _BATCH_MODEL
+    api_key = get_api_key(PROJECT_ID, SECRET_ID)
+    if api_key != _CONFIGURED_API_KEY:
+        get_genai().configure(api_key=api_key)
+        _CONFIGURED_API_KEY = api_key
+        _MODEL = None
+        _BATCH_MODEL = None
+
+
+def create_cached_model(generation_config):
+    """
+    Creates a model whose system prompt lives in a Gemini context cache.
+    Returns None if context caching isn't available for this prompt/model.
+    """
+    global _CONTEXT_CACHE_UNAVAILABLE
+    if _CONTEXT_CACHE_UNAVAILABLE:
+        return None
+    try:
+        cache = get_genai().caching.CachedContent.create(
+            model=MODEL_NAME,
+            system_instruction=SYSTEM_PROMPT,
+            ttl=CONTEXT_CACHE_TTL,
+            display_name="ui_analyzer_sys"
+        )
+    except Exception as e:
+        logger.warning("⚠️ Кэш контекста недоступен, используется обычный system_instruction: %s", e)
+        if isinstance(e, get_api_exceptions().InvalidArgument) and "too small" in str(e).lower():
+            # The model's minimum is above CONTEXT_CACHE_MIN_TOKENS
+            _CONTEXT_CACHE_UNAVAILABLE = True
+        return None
+    return get_genai().GenerativeModel.from_cached_content(cached_content=cache, generation_config=generation_config)
+
+
+def get_model():
+    """
+    Returns the shared Gemini model, creating it on first use.
+    The system prompt is served from a context cache when possible.
+    """
+    global _MODEL, _MODEL_EXPIRES_AT
+    with _MODEL_LOCK:
+        configure_genai()
+        if _MODEL is not None and _MODEL_EXPIRES_AT is not None and time.monotonic() >= _MODEL_EXPIRES_AT:
+            # The context cache is about to expire (or is due a retry); build a new one
+            _MODEL = None
+        if _MODEL is None:
+            # System prompt and schema-constrained JSON output are set once on the model
+            generation_config = {"response_mime_type": "application/json", "response_schema": UIAnalysis}
+            _MODEL = create_cached_model(generation_config)
+            if _MODEL is not None:
+                _MODEL_EXPIRES_AT = time.monotonic() + CONTEXT_CACHE_TTL.total_seconds() - 300
+            else:
+                # After a transient failure the cache is tried again later
+                _MODEL_EXPIRES_AT = None if _CONTEXT_CACHE_UNAVAILABLE else time.monotonic() + CONTEXT_CACHE_RETRY_SECONDS
+                _MODEL = get_genai().GenerativeModel(
+                    MODEL_NAME,
+                    system_instruction=SYSTEM_PROMPT,
+                    generation_config=generation_config
+                )
+        return _MODEL
+
+
+def get_batch_model():
+    """
+    Returns the shared Gemini model for multi-image requests, creating it on first use.
+    """
+    global _BATCH_MODEL
+    with _MODEL_LOCK:
+        configure_genai()
+        if _BATCH_MODEL is None:
+            _BATCH_MODEL = get_genai().GenerativeModel(
+                MODEL_NAME,
+                system_instruction=SYSTEM_PROMPT_MULTI,
+                generation_config={"response_mime_type": "application/json", "response_schema": UIBatchAnalysis}
+            )
+        return _BATCH_MODEL
+
+
+def collect_mx_cell(cell, nodes, edges):
+    """
+    Adds a Draw.io <mxCell> to the nodes dict or the edges list.
+    """
+    if cell.get("vertex") == "1" and cell.get("value"):
+        nodes[cell.get("id")] = cell.get("value")
+    elif cell.get("edge") == "1" and cell.get("source") and cell.get("target"):
+        edges.append((cell.get("source"), cell.get("target")))
+
+
+def parse_drawio_diagram(file_path):
+    """
+    Parses a Draw.io diagram file (XML) to extract nodes and edges.
+    The XML is streamed with iterparse and every element is cleared once it
+    has been read, so large diagrams are parsed in bounded memory.
+    Compressed diagrams (base64 + raw deflate + URL encoding) are decoded
+    and streamed the same way.
+
+    Returns:
+        tuple: (nodes, edges) where nodes is {id: label} and
+               edges is a list of (source_id, target_id) tuples.
+    """
+    nodes = {}
+    edges = []
+
+    try:
+        for _, element in ET.iterparse(file_path):
+            if element.tag == "mxCell":
+                collect_mx_cell(element, nodes, edges)
+            elif element.tag == "diagram" and element.text and element.text.strip():
+                # Compressed diagram: the graph model is stored as encoded text
+                inflated = zlib.decompress(base64.b64decode(element.text), -15)
+                inner_xml = urllib.parse.unquote_to_bytes(inflated)
+                for _, inner_element in ET.iterparse(io.BytesIO(inner_xml)):
+                    if inner_element.tag == "mxCell":
+                        collect_mx_cell(inner_element, nodes, edges)
+                    inner_element.clear()
+            element.clear()
+    except FileNotFoundError:
+        logger.error("Error: Diagram file not found at %s", file_path)
+    except Exception as e:
+        logger.error("An error occurred during diagram parsing: %s", e)
+
+    return nodes, edges
+
+
+def build_dependency_map(nodes, edges):
+    """
+    Maps every node to the nodes it has to wait for, given (source, target) edges.
+    Edges that close a cycle (e.g. feedback loops) are ignored, so the
+    resulting dependencies are acyclic.
+    """
+    successors = {node_id: [] for node_id in nodes}
+    for source, target in edges:
+        if source in successors and target in successors:
+            successors[source].append(target)
+
+    predecessors = {node_id: [] for node_id in nodes}
+    # Iterative DFS; 1 = node is on the current path, 2 = node is finished
+    state = {}
+    for root in nodes:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node_id, children = stack[-1]
+            for child in children:
+                if state.get(child) == 1:
+                    # Back edge: following it would close a cycle
+                    continue
+                predecessors[child].append(node_id)
+                if child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                state[node_id] = 2
+                stack.pop()
+    return predecessors
+
+
+async def run_agent(nodes, edges):
+    """
+    Executes the agent logic based on the parsed diagram.
+    For now, it just prints the flow.
+    Every node runs as its own task that waits only for the nodes it depends
+    on, so independent branches run concurrently and the total time follows
+    the critical path instead of the node count.
+    """
+    # In a real scenario, you would implement the agent's logic
+    # here, using the parsed nodes and edges.
+    # For now, we'll just simulate the flow.
+    logger.info("Agent started.")
+    predecessors = build_dependency_map(nodes, edges)
+    tasks = {}
+
+    async def visit(node_id):
+        await asyncio.gather(*(tasks[dependency] for dependency in predecessors[node_id]))
+        logger.info("Agent visiting node %s ('%s').", node_id, nodes[node_id])
+        # Optional simulated processing time, without blocking the event loop
+        if AGENT_STEP_DELAY_S > 0:
+            await asyncio.sleep(AGENT_STEP_DELAY_S)
+
+    # All tasks exist before any of them starts running
+    for node_id in nodes:
+        tasks[node_id] = asyncio.create_task(visit(node_id))
+    await asyncio.gather(*tasks.values())
+    logger.info("Agent finished.")
+    return "Agent run completed following the diagram."
+
+
+def json_loads(text):
+    """
+    Parses JSON with orjson when it is installed, otherwise with the stdlib.
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def parse_model_json(text):
+    """
+    Parses a JSON model response. Bare JSON takes the fast path; otherwise
+    markdown fences are stripped in one pass and the first JSON value is
+    decoded, ignoring any trailing text after it.
+    """
+    try:
+        return json_loads(text)
+    except json.JSONDecodeError:
+        text = _FENCE_RE.sub("", text)
+        return _JSON_DECODER.raw_decode(text, text.find("{") if "{" in text else 0)[0]
+
+
+def json_dumps(obj):
+    """
+    Serializes to a compact UTF-8 JSON string with orjson when it is installed.
+    The stdlib fallback produces the same output: non-ASCII text (e.g. Russian
+    descriptions) is kept as is instead of six-byte \\uXXXX escapes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_encode_buffer():
+    """
+    Returns the calling thread's reusable image encode buffer.
+    The buffer is rewound but not truncated, because BytesIO.truncate(0)
+    releases its allocation; callers read back only the first tell() bytes.
+    """
+    buffer = getattr(_TLS, "buffer", None)
+    if buffer is None:
+        buffer = _TLS.buffer = io.BytesIO()
+    else:
+        buffer.seek(0)
+    return buffer
+
+
+def write_encoded_image(image, file_obj, image_format):
+    """
+    Encodes a PIL image and writes it to an open binary file in a single call.
+    PNG goes through imagecodecs when it is installed, otherwise Pillow.
+    """
+    if image_format == "PNG" and imagecodecs is not None and image.mode in ("L", "RGB", "RGBA"):
+        file_obj.write(imagecodecs.png_encode(np.asarray(image), level=1))
+        return
+
+    buffered = get_encode_buffer()
+    if image_format == "PNG":
+        image.save(buffered, format="PNG", compress_level=1)
+    else:
+        image.convert("RGB").save(buffered, format="WEBP", quality=85, method=0)
+    with buffered.getbuffer() as view:
+        file_obj.write(view[:buffered.tell()])
+
+
+def save_render_image(image, key=None):
+    """
+    Saves the screenshot into RENDER_DIR and returns the URL Gradio serves it at.
+    Images with transparency stay PNG, everything else is stored as WebP.
+    Files are memoized by image content (key, see image_key()), so re-rendering
+    the same image (e.g. on every streamed update) doesn't encode it again.
+    Only the last RENDER_CACHE_SIZE images are kept on disk.
+    """
+    if key is None:
+        key = image_key(image)
+    with _RENDER_LOCK:
+        path = _RENDERED_FILES.get(key)
+        if path is not None:
+            _RENDERED_FILES.move_to_end(key)
+            return f"{_FILE_ROUTE}{path}"
+
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image_format, suffix = "PNG", ".png"
+    else:
+        image_format, suffix = "WEBP", ".webp"
+
+    # Content-addressed name: the same image always gets the same URL, so the
+    # browser keeps using its cached copy across re-renders and evictions.
+    # Written to a temporary file first so a reader never sees a partial image;
+    # the temporary file is removed if encoding or the rename fails.
+    path = os.path.join(RENDER_DIR, f"uix_{key}{suffix}")
+    f = tempfile.NamedTemporaryFile(suffix=suffix, dir=RENDER_DIR, delete=False)
+    try:
+        with f:
+            write_encoded_image(image, f, image_format)
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+    with _RENDER_LOCK:
+        _RENDERED_FILES[key] = path
+        while len(_RENDERED_FILES) > RENDER_CACHE_SIZE:
+            _, old_path = _RENDERED_FILES.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    return f"{_FILE_ROUTE}{path}"
+
+
+def prepare_elements(elements, width, height):
+    """
+    Validates the element records in a single pass, skipping malformed ones,
+    and converts their boxes to percentages of the image size in one
+    vectorized step.
+    Returns (id, left, top, width, height, description) tuples.
+    """
+    ids = []
+    boxes = []
+    descriptions = []
+    for element in elements:
+        if not isinstance(element, dict):
+            continue
+        box = element.get("box")
+        description = element.get("description")
+        if description and isinstance(box, list) and len(box) == 4:
+            ids.append(element.get("id", "?"))
+            boxes.append(box)
+            descriptions.append(description)
+    if not boxes:
+        return []
+
+    # (N, 4) corners, clipped to the image so boxes never spill over the
+    # screenshot -> left, top, width, height in percent
+    geometry = np.asarray(boxes, dtype=np.float64)
+    np.clip(geometry, 0.0, np.array([width, height, width, height], dtype=np.float64), out=geometry)
+    geometry[:, 2:] -= geometry[:, :2]
+    geometry *= np.array([100.0 / width, 100.0 / height, 100.0 / width, 100.0 / height])
+    return [
+        (element_id, left, top, box_width, box_height, description)
+        for element_id, (left, top, box_width, box_height), description in zip(ids, geometry.tolist(), descriptions)
+    ]
+
+
+def _nms_keep_loop(boxes, iou_threshold):
+    """
+    Greedy non-maximum suppression over an (N, 4) array of corner boxes,
+    in input order. Returns a boolean mask of the boxes to keep.
+    Written as plain loops so numba can compile it.
+    """
+    n = boxes.shape[0]
+    keep = np.ones(n, dtype=np.bool_)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    for i in range(n):
+        if not keep[i]:
+            continue
+        for j in range(i + 1, n):
+            if not keep[j]:
+                continue
+            inter_w = min(boxes[i, 2], boxes[j, 2]) - max(boxes[i, 0], boxes[j, 0])
+            inter_h = min(boxes[i, 3], boxes[j, 3]) - max(boxes[i, 1], boxes[j, 1])
+            if inter_w <= 0 or inter_h <= 0:
+                continue
+            inter = inter_w * inter_h
+            union = areas[i] + areas[j] - inter
+            if union > 0 and inter / union > iou_threshold:
+                keep[j] = False
+    return keep
+
+
+def _nms_keep_numpy(boxes, iou_threshold):
+    """
+    NumPy version of _nms_keep_loop, comparing each kept box with all later ones at once.
+    """
+    n = boxes.shape[0]
+    keep = np.ones(n, dtype=bool)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    for i in range(n - 1):
+        if not keep[i]:
+            continue
+        rest = boxes[i + 1:]
+        inter_w = np.minimum(boxes[i, 2], rest[:, 2]) - np.maximum(boxes[i, 0], rest[:, 0])
+        inter_h = np.minimum(boxes[i, 3], rest[:, 3]) - np.maximum(boxes[i, 1], rest[:, 1])
+        inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+        union = areas[i] + areas[i + 1:] - inter
+        with np.errstate(divide="ignore", invalid="ignore"):
+            duplicate = (union > 0) & (inter / union > iou_threshold)
+        keep[i + 1:] &= ~duplicate
+    return keep
+
+
+nms_keep = numba.njit(cache=True)(_nms_keep_loop) if numba is not None else _nms_keep_numpy
+
+
+def extract_boxes(elements):
+    """
+    Collects the boxes of element records into an (N, 4) float array in a
+    single pass, so box math runs as array operations.
+    Returns the indices of the records with a valid box and the array.
+    """
+    indices = []
+    boxes = []
+    for i, element in enumerate(elements):
+        box = element.get("box") if isinstance(element, dict) else None
+        if isinstance(box, list) and len(box) == 4:
+            indices.append(i)
+            boxes.append(box)
+    return indices, np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def deduplicate_elements(elements, iou_threshold=DUPLICATE_IOU_THRESHOLD):
+    """
+    Drops elements whose box duplicates an earlier element's box.
+    Records without a valid box are left untouched.
+    """
+    indices, boxes = extract_boxes(elements)
+    if len(indices) < 2:
+        return elements
+
+    keep = nms_keep(boxes, iou_threshold)
+    dropped = {index for index, kept in zip(indices, keep.tolist()) if not kept}
+    if not dropped:
+        return elements
+    return [element for i, element in enumerate(elements) if i not in dropped]
+
+
+def create_interactive_html(img_url, img_size, elements):
+    """
+    Creates an interactive HTML visualization with clear, non-blurred borders.
+    Takes the URL of the already saved screenshot (see save_render_image())
+    and elements already converted by prepare_elements().
+    """
+    logger.debug("create_interactive_html called. Image: %s, elements: %d", img_url is not None, len(elements) if elements else 0)
+
+    if img_url is None or not elements:
+        logger.debug("Invalid input for create_interactive_html.")
+        return "<p>No elements to visualize or invalid data.</p>"
+    
+    # Get image dimensions; the container keeps the aspect ratio when scaled down
+    img_width, img_height = img_size
+    
+    # Create HTML with interactive areas - SHARP BORDERS for ML training
+    parts = [f"""
+    <div id="interactive-container" style="position: relative; width: 100%; max-width: {img_width}px; aspect-ratio: {img_width} / {img_height}; margin: auto; border: 1px solid #ddd; border-radius: 8px; overflow: hidden;">
+        <img src="{img_url}" 
+             style="position: absolute; top: 0; left: 0; width: 100%; height: 100%;" 
+             id="ui-image" />
+        <div id="overlay" style="position: absolute; top: 0; left: 0; width: 100%; height: 100%; pointer-events: none;">
+    """]
+    
+    # Add interactive areas for each element, positioned in percent of the image
+    for position, (element_id, left_pct, top_pct, width_pct, height_pct, _) in enumerate(elements):
+        parts.append(_ELEMENT_TEMPLATE % (
+            position, left_pct, top_pct, width_pct, height_pct, _html_escape(str(element_id))
+        ))
+    
+    # Descriptions are sent once as JSON, in element order, and looked up by
+    # position in the script, so repeated or missing ids keep their own text
+    descriptions = [element[5] for element in elements]
+    parts.append(_RENDER_TAIL_HEAD)
+    parts.append(json_dumps(descriptions).replace("</", "<\\/"))
+    parts.append(_RENDER_TAIL_END)
+    return "".join(parts)
+
+
+def reduce_for_analysis(image):
+    """
+    Returns a copy of the image whose longer side is at most
+    MAX_ANALYSIS_SIDE, or the image itself if it is already small enough.
+    Uses Image.reduce (integer box-filter subsampling), which is much
+    cheaper than a resampling resize and good enough for UI screenshots.
     """
-    return html_content
+    factor = -(-max(image.size) // MAX_ANALYSIS_SIDE)
+    if factor <= 1:
+        return image
+    if image.mode == "P":
+        image = image.convert("RGBA")
+    return image.reduce(factor)
+
+
+def restore_box_scale(json_response, analysis_size, display_size):
+    """
+    Maps element boxes from the pixels of the (downscaled) image sent to
+    Gemini to those of the original image. Returns a new response dict; the
+    given one may be cached and is left untouched.
+    """
+    if analysis_size == display_size:
+        return json_response
+    elements = list(json_response.get("elements", []))
+    indices, boxes = extract_boxes(elements)
+    if not indices:
+        return json_response
+    scale_x = display_size[0] / analysis_size[0]
+    scale_y = display_size[1] / analysis_size[1]
+    scaled = np.rint(boxes * np.array([scale_x, scale_y, scale_x, scale_y])).astype(np.int64).tolist()
+    for i, box in zip(indices, scaled):
+        elements[i] = {**elements[i], "box": box}
+    return {**json_response, "elements": elements}
 
 
 def handle_image_upload(image):
     """
     Handles the image upload and enables the analysis button.
-    No resizing - image is used as-is.
+    The original image is displayed; large screenshots are sent to Gemini
+    as a downscaled copy (see reduce_for_analysis()).
+    The image is hashed and its display copy saved here, so analysis neither
+    hashes nor encodes it again unless the copy has been evicted since.
     """
     if image is None:
         # If image is cleared, disable the button
-        return None, gr.update(interactive=False), "Загрузите изображение для анализа."
+        return None, None, gr.update(interactive=False), "Загрузите изображение для анализа."
     
-    print(f"🖼️ Изображение загружено: {image.size} (используется в оригинальном размере)...")
-    # No resizing - use original image
-    print("✅ Изображение готово к анализу (оригинальный размер).")
-    # Return the original image and enable the button
-    return image, gr.update(interactive=True), "Изображение готово к анализу."
+    logger.info("🖼️ Изображение загружено: %s...", image.size)
+    # Hash and encode the screenshot for display once, off the analysis path
+    key = image_key(image)
+    save_render_image(image, key)
+    image_info = {"key": key, "image": image, "size": image.size}
+    analysis_image = reduce_for_analysis(image)
+    logger.info("✅ Изображение готово к анализу (размер для модели: %s).", analysis_image.size)
+    # Return the image to analyse, the original with its key and size, and enable the button
+    return analysis_image, image_info, gr.update(interactive=True), "Изображение готово к анализу."
+
+
+def image_key(image):
+    """
+    Returns a content hash of a PIL image, used to recognise repeated submissions.
+    """
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
 
 
-def analyze_ui_elements(processed_image):
+def get_cached_analysis(key):
+    """
+    Returns the cached analysis for an image key, or None.
+    """
+    with _ANALYSIS_LOCK:
+        json_response = _ANALYSIS_CACHE.get(key)
+        if json_response is not None:
+            _ANALYSIS_CACHE.move_to_end(key)
+        return json_response
+
+
+def store_cached_analysis(key, json_response):
+    """
+    Stores an analysis result, evicting the least recently used entries.
+    """
+    with _ANALYSIS_LOCK:
+        _ANALYSIS_CACHE[key] = json_response
+        _ANALYSIS_CACHE.move_to_end(key)
+        while len(_ANALYSIS_CACHE) > ANALYSIS_CACHE_SIZE:
+            _ANALYSIS_CACHE.popitem(last=False)
+
+
+def get_uploaded_image(image, key):
+    """
+    Returns a Gemini Files API handle for the image, uploading it on first use.
+    Repeat analyses of the same image (e.g. retries) reference the uploaded
+    file instead of sending the image bytes again.
+    """
+    now = time.monotonic()
+    with _UPLOAD_LOCK:
+        cached = _UPLOADED_FILES.get(key)
+        if cached is not None and now - cached[1] < UPLOAD_TTL_SECONDS:
+            _UPLOADED_FILES.move_to_end(key)
+            return cached[0]
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=1)
+    buffered.seek(0)
+    uploaded = get_genai().upload_file(buffered, mime_type="image/png", display_name=f"ui_{key[:16]}")
+
+    with _UPLOAD_LOCK:
+        _UPLOADED_FILES[key] = (uploaded, now)
+        _UPLOADED_FILES.move_to_end(key)
+        while len(_UPLOADED_FILES) > UPLOAD_CACHE_SIZE:
+            _UPLOADED_FILES.popitem(last=False)
+    return uploaded
+
+
+def parse_partial_elements(text, pos=0):
+    """
+    Extracts the element objects that are already complete in a partially
+    streamed JSON response. Returns the new elements and the position to
+    resume parsing from once more text has arrived.
+    """
+    elements = []
+    if pos == 0:
+        # Locate the start of the "elements" array
+        key_pos = text.find('"elements"')
+        array_pos = text.find("[", key_pos) if key_pos >= 0 else -1
+        if array_pos < 0:
+            return elements, 0
+        pos = array_pos + 1
+
+    length = len(text)
+    while True:
+        while pos < length and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= length or text[pos] != "{":
+            return elements, pos
+        try:
+            element, pos_end = _JSON_DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            # The object is still being streamed
+            return elements, pos
+        elements.append(element)
+        pos = pos_end
+
+
+async def analyze_ui_elements(processed_image, image_info=None):
     """
     Analyzes the UI elements in the given image using the Gemini model.
+    Streams the response and yields the interactive HTML as elements arrive.
+    Runs as an async generator, so waiting on Gemini doesn't hold a worker thread.
+    image_info holds the original image with its key and size computed on
+    upload; they are computed here if missing. processed_image may be a
+    downscaled copy (see reduce_for_analysis()); boxes are mapped back to the
+    original image's pixels before they are returned.
     """
     if processed_image is None:
-        print("❌ ERROR: processed_image is None")
-        return None, {"elements": []}, "Произошла ошибка: изображение для анализа отсутствует.", "Нажмите на элемент, чтобы увидеть его описание."
+        logger.error("❌ ERROR: processed_image is None")
+        yield {"elements": []}, "Произошла ошибка: изображение для анализа отсутствует.", ELEMENT_INFO_PLACEHOLDER, None
+        return
+
+    # Hashing, encoding and HTML building are CPU work, so they run in worker
+    # threads rather than on the event loop
+    if image_info is None:
+        key = await asyncio.to_thread(image_key, processed_image)
+        image_info = {"key": key, "image": processed_image, "size": processed_image.size}
+    cache_key = image_info["key"]
+    display_size = image_info["size"]
+    # Looked up again rather than kept in the session state: the file saved on
+    # upload may have been evicted by later renders, in which case it is re-saved
+    image_url = await asyncio.to_thread(save_render_image, image_info["image"], cache_key)
+
+    # Identical images are answered from the cache without calling Gemini
+    json_response = get_cached_analysis(cache_key)
+    if json_response is not None:
+        logger.info("♻️ Результат анализа взят из кэша: %d элементов.", len(json_response.get("elements", [])))
+        prepared = await asyncio.to_thread(prepare_elements, json_response.get("elements", []), *display_size)
+        html_output = await asyncio.to_thread(create_interactive_html, image_url, display_size, prepared)
+        yield json_response, f"Найдено {len(json_response.get('elements', []))} элементов.", ELEMENT_INFO_PLACEHOLDER, html_output
+        return
     
-    print(f"🤖 Отправка изображения в Vertex AI: {processed_image.size}...")
+    if BATCH_ANALYSIS:
+        # Concurrent submissions share one Gemini request; results are not streamed
+        try:
+            json_response = await analyze_in_batch(processed_image, cache_key, display_size)
+        except Exception as e:
+            logger.error("❌ Произошла ошибка во время пакетного анализа: %s", e)
+            yield {"elements": []}, f"Ошибка анализа: {e}", ELEMENT_INFO_PLACEHOLDER, None
+            return
+        prepared = await asyncio.to_thread(prepare_elements, json_response.get("elements", []), *display_size)
+        logger.info("✅ Анализ успешно завершен: найдено %d элементов.", len(json_response.get("elements", [])))
+        html_output = await asyncio.to_thread(create_interactive_html, image_url, display_size, prepared)
+        yield json_response, f"Найдено {len(json_response.get('elements', []))} элементов.", ELEMENT_INFO_PLACEHOLDER, html_output
+        return
+
+    logger.info("🤖 Отправка изображения в Vertex AI: %s...", processed_image.size)
 
     try:
-        # Configure the generative model
-        api_key = get_api_key(PROJECT_ID, SECRET_ID)
-        genai.configure(api_key=api_key)
+        # Reuse the configured model; a warm call does no setup work. A cold or
+        # expiring one fetches the API key and creates the context cache, which
+        # are blocking RPCs, so it runs in a worker thread.
+        model = await asyncio.to_thread(get_model)
+        retryable_errors = get_retryable_api_errors()
 
-        # Create the model instance
-        model = genai.GenerativeModel(MODEL_NAME)
+        # Send the image once through the Files API; repeats reuse the handle.
+        # The SDK upload is blocking, so it runs in a worker thread.
+        uploaded_image = await asyncio.to_thread(get_uploaded_image, processed_image, cache_key)
 
-        # Send the processed image to the model
-        response = model.generate_content([SYSTEM_PROMPT, processed_image])
-        
-        # Clean up the response
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
-        json_response = json.loads(cleaned_response)
+        for attempt in range(MAX_ANALYSIS_ATTEMPTS):
+            # Retries ask for a deterministic answer, which is more likely to be valid JSON
+            generation_config = None if attempt == 0 else RETRY_GENERATION_CONFIG
+
+            try:
+                # Stream the response so elements can be shown before the model finishes
+                response = await model.generate_content_async([uploaded_image], stream=True, generation_config=generation_config)
+
+                text = ""
+                elements = []
+                prepared = []
+                parse_pos = 0
+                async for chunk in response:
+                    chunk_text = chunk.text
+                    text += chunk_text
+                    # An element object can only complete in a chunk containing "}"
+                    if "}" not in chunk_text:
+                        continue
+                    new_elements, parse_pos = parse_partial_elements(text, parse_pos)
+                    if new_elements:
+                        # Streamed JSON is shown in original-image pixels, like the final one
+                        elements.extend(restore_box_scale({"elements": new_elements}, processed_image.size, display_size)["elements"])
+                        # Geometry is computed once per element as it arrives; percentages
+                        # of the analysed image apply unchanged to the original
+                        prepared.extend(prepare_elements(new_elements, *processed_image.size))
+                        yield {"elements": elements}, f"Анализ... найдено {len(elements)} элементов.", ELEMENT_INFO_PLACEHOLDER, create_interactive_html(image_url, display_size, prepared)
+                
+                # The response schema asks for bare JSON; stray fences are tolerated
+                json_response = parse_model_json(text)
+                # The model often repeats a box; drop duplicates before rendering
+                json_response["elements"] = deduplicate_elements(json_response.get("elements", []))
+                json_response = restore_box_scale(json_response, processed_image.size, display_size)
+                break
+            except json.JSONDecodeError as e:
+                # Malformed output: retry right away
+                if attempt == MAX_ANALYSIS_ATTEMPTS - 1:
+                    raise
+                logger.warning("⚠️ Некорректный JSON от модели (%s), повторная попытка %d/%d...", e, attempt + 2, MAX_ANALYSIS_ATTEMPTS)
+            except retryable_errors as e:
+                # Transient API error: retry with exponential backoff
+                if attempt == MAX_ANALYSIS_ATTEMPTS - 1:
+                    raise
+                delay = RETRY_BASE_DELAY_SECONDS * 2 ** attempt
+                logger.warning("⚠️ Временная ошибка API (%s), повтор через %.1f с...", e, delay)
+                await asyncio.sleep(delay)
+
+        store_cached_analysis(cache_key, json_response)
+
+        # The streamed elements normally match the final response already
+        final_elements = json_response.get("elements", [])
+        if len(final_elements) != len(elements):
+            prepared = prepare_elements(final_elements, *display_size)
         
-        print(f"✅ Анализ успешно завершен: найдено {len(json_response.get('elements', []))} элементов.")
+        logger.info("✅ Анализ успешно завершен: найдено %d элементов.", len(json_response.get("elements", [])))
         
-        # Return the *processed* image and the JSON data for visualization
-        return processed_image, json_response, f"Найдено {len(json_response.get('elements', []))} элементов.", "Нажмите на элемент, чтобы увидеть его описание."
+        # Return the JSON data and its visualization
+        yield json_response, f"Найдено {len(json_response.get('elements', []))} элементов.", ELEMENT_INFO_PLACEHOLDER, create_interactive_html(image_url, display_size, prepared)
 
     except Exception as e:
-        print(f"❌ Произошла ошибка во время анализа: {e}")
-        return processed_image, {"elements": []}, f"Ошибка анализа: {e}", "Нажмите на элемент, чтобы увидеть его описание."
+        logger.error("❌ Произошла ошибка во время анализа: %s", e)
+        yield {"elements": []}, f"Ошибка анализа: {e}", ELEMENT_INFO_PLACEHOLDER, None
+
+
+async def analyze_ui_elements_batch(images, keys=None, display_sizes=None):
+    """
+    Analyzes several screenshots with a single Gemini request.
+    Returns one {"elements": [...]} dict per image, in input order.
+    Cached images are not sent again; images the model skipped get no elements.
+    keys are the image keys if already known (hashed here otherwise).
+    display_sizes are the original sizes of downscaled images; boxes are
+    mapped back to them before results are cached and returned, so the
+    cache holds original-image coordinates like the single-image path.
+    """
+    if keys is None:
+        keys = [image_key(image) for image in images]
+    if display_sizes is None:
+        display_sizes = [image.size for image in images]
+    results = [get_cached_analysis(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    logger.info("🤖 Пакетный анализ: %d изображений в одном запросе...", len(pending))
+    model = await asyncio.to_thread(get_batch_model)
+    uploaded_images = await asyncio.gather(*[
+        asyncio.to_thread(get_uploaded_image, images[i], keys[i]) for i in pending
+    ])
+    response = await model.generate_content_async(list(uploaded_images))
+    batch_results = parse_model_json(response.text).get("results", [])
+
+    for position, i in enumerate(pending):
+        if position < len(batch_results):
+            result = batch_results[position]
+            result["elements"] = deduplicate_elements(result.get("elements", []))
+            results[i] = restore_box_scale(result, images[i].size, display_sizes[i])
+            store_cached_analysis(keys[i], results[i])
+        else:
+            results[i] = {"elements": []}
+    return results
+
+
+async def run_batch_worker():
+    """
+    Collects queued submissions for up to BATCH_MAX_WAIT_SECONDS (at most
+    BATCH_MAX_SIZE of them) and analyzes them with one batch request,
+    resolving each submission's future with its own result.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _BATCH_QUEUE.get()]
+        deadline = loop.time() + BATCH_MAX_WAIT_SECONDS
+        while len(batch) < BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_BATCH_QUEUE.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            images, keys, display_sizes, futures = zip(*batch)
+            results = await analyze_ui_elements_batch(list(images), list(keys), list(display_sizes))
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+async def analyze_in_batch(image, key, display_size):
+    """
+    Submits an image to the micro-batcher and waits for its analysis result,
+    in the coordinates of the original image of size display_size.
+    key is the original image's key, under which the result is cached.
+    """
+    global _BATCH_QUEUE, _BATCH_WORKER
+    if _BATCH_WORKER is None or _BATCH_WORKER.done():
+        _BATCH_QUEUE = asyncio.Queue()
+        _BATCH_WORKER = asyncio.create_task(run_batch_worker())
+    future = asyncio.get_running_loop().create_future()
+    await _BATCH_QUEUE.put((image, key, display_size, future))
+    return await future
+
+
+def drain_feedback_queue():
+    """
+    Background writer: appends queued feedback to FEEDBACK_FILE through a
+    single long-lived handle, writing and flushing everything that has
+    accumulated at once.
+    """
+    global _FEEDBACK_FILE_HANDLE
+    while True:
+        batch = [_FEEDBACK_QUEUE.get()]
+        while True:
+            try:
+                batch.append(_FEEDBACK_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if _FEEDBACK_FILE_HANDLE is None:
+                _FEEDBACK_FILE_HANDLE = open(FEEDBACK_FILE, "a", encoding="utf-8", buffering=1 << 16)
+            _FEEDBACK_FILE_HANDLE.write("".join(f"Отзыв: {text}\n" for text in batch))
+            _FEEDBACK_FILE_HANDLE.flush()
+        except Exception:
+            # Any failure only loses this batch; the writer thread keeps running
+            logger.exception("❌ Не удалось сохранить отзывы")
+        finally:
+            for _ in batch:
+                _FEEDBACK_QUEUE.task_done()
+
+
+def close_feedback_writer():
+    """
+    Waits for queued feedback to be written, then closes the feedback file.
+    """
+    _FEEDBACK_QUEUE.join()
+    if _FEEDBACK_FILE_HANDLE is not None:
+        _FEEDBACK_FILE_HANDLE.close()
 
 
 def handle_feedback(feedback_text):
     """
     Handles user feedback submission.
+    The feedback is queued and written to disk by a background thread.
     """
     if not feedback_text.strip():
         return "Пожалуйста, введите ваш отзыв."
     
-    print(f"📝 Получен отзыв пользователя: {feedback_text}")
+    logger.info("📝 Получен отзыв пользователя: %s", feedback_text)
     
     # Here you could save feedback to a database or file
-    # For now, we'll just acknowledge receipt
-    with open("feedback.txt", "a", encoding="utf-8") as f:
-        f.write(f"Отзыв: {feedback_text}\n")
+    # For now, the writer thread appends it to FEEDBACK_FILE
+    try:
+        _FEEDBACK_QUEUE.put_nowait(feedback_text)
+    except queue.Full:
+        return "Сервер перегружен, попробуйте отправить отзыв позже."
     
     return "Спасибо за ваш отзыв! Он поможет улучшить качество анализа."
 
 
+threading.Thread(target=drain_feedback_queue, name="feedback-writer", daemon=True).start()
+# Write out queued feedback and close the file before the interpreter exits
+atexit.register(close_feedback_writer)
+
+
+def stream_safe_gzip(app, minimum_size=GZIP_MINIMUM_SIZE):
+    """
+    Wraps an ASGI app in Starlette's GZipMiddleware, except for
+    text/event-stream responses, which go to the client untouched.
+    Older Starlette versions gzip streamed responses without flushing, which
+    would hold back Gradio's queue updates (sent over SSE).
+    """
+    async def gzip_app(scope, receive, send):
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+
+        async def app_bypassing_streams(scope, receive, gzip_send):
+            target = gzip_send
+
+            async def route(message):
+                nonlocal target
+                if message["type"] == "http.response.start":
+                    headers = dict(message.get("headers", []))
+                    if headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+                        # The gzip responder never sees this response
+                        target = send
+                await target(message)
+
+            await app(scope, receive, route)
+
+        await GZipMiddleware(app_bypassing_streams, minimum_size=minimum_size)(scope, receive, send)
+
+    return gzip_app
+
+
 def main():
     """Main function to launch the Gradio app."""
-    print("Launching Gradio app...")
+    # Log level is read from LOG_LEVEL (INFO by default); DEBUG adds render traces
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    logger.info("Launching Gradio app...")
 
     # Define Gradio interface components
-    with gr.Blocks(title=APP_TITLE, theme=gr.themes.Soft()) as demo:
+    # The overlay style and script are loaded once with the page; results only carry markup and data
+    with gr.Blocks(title=APP_TITLE, theme=gr.themes.Soft(), head=_STATIC_HEAD) as demo:
         gr.Markdown(f"# {APP_TITLE}")
         gr.Markdown(APP_DESCRIPTION)
 
@@ -373,8 +1423,11 @@ def main():
                 # Hidden component to store the JSON data
                 json_data_output = gr.JSON(visible=False)
                 
-                # Hidden component to store the processed image
-                processed_image_output = gr.Image(visible=False, type="pil")
+                # The uploaded PIL image, kept in-process between events
+                processed_image_state = gr.State()
+
+                # Content key and display URL of the image, computed once on upload
+                image_info_state = gr.State()
 
         # Element information display
         with gr.Row():
@@ -382,7 +1435,7 @@ def main():
                 gr.Markdown("### Информация о выбранном элементе")
                 element_info_output = gr.Textbox(
                     label="Описание элемента",
-                    value="Нажмите на элемент, чтобы увидеть его описание.",
+                    value=ELEMENT_INFO_PLACEHOLDER,
                     interactive=False,
                     lines=3
                 )
@@ -404,23 +1457,19 @@ def main():
         image_input.upload(
             fn=handle_image_upload,
             inputs=image_input,
-            outputs=[processed_image_output, submit_button, status_output]
+            outputs=[processed_image_state, image_info_state, submit_button, status_output]
         )
         
         image_input.clear(
-            fn=lambda: (None, gr.update(interactive=False), None, None, "Пожалуйста, загрузите изображение для анализа.", "Нажмите на элемент, чтобы увидеть его описание."),
+            fn=lambda: (None, None, gr.update(interactive=False), None, None, "Пожалуйста, загрузите изображение для анализа.", ELEMENT_INFO_PLACEHOLDER),
             inputs=[],
-            outputs=[processed_image_output, submit_button, html_output, json_data_output, status_output, element_info_output]
+            outputs=[processed_image_state, image_info_state, submit_button, html_output, json_data_output, status_output, element_info_output]
         )
         
         submit_button.click(
             fn=analyze_ui_elements,
-            inputs=processed_image_output,
-            outputs=[processed_image_output, json_data_output, status_output, element_info_output]
-        ).then(
-            fn=create_interactive_html,
-            inputs=[processed_image_output, json_data_output],
-            outputs=html_output
+            inputs=[processed_image_state, image_info_state],
+            outputs=[json_data_output, status_output, element_info_output, html_output]
         )
         
         feedback_button.click(
@@ -434,15 +1483,19 @@ def main():
         )
 
     # Launch the Gradio app
-    print("🚀 Запускаем Gradio приложение...")
+    logger.info("🚀 Запускаем Gradio приложение...")
     # To make it accessible on the local network and create a public link
-    demo.launch(server_name="127.0.0.1", server_port=7862, share=True, debug=True)
+    demo.queue(default_concurrency_limit=QUEUE_CONCURRENCY_LIMIT)
+    # Responses above GZIP_MINIMUM_SIZE bytes (the result HTML, the screenshot
+    # route) are gzip-compressed on the wire; the SSE queue stream is not
+    demo.launch(
+        server_name="127.0.0.1", server_port=7862, share=True, debug=True, allowed_paths=[RENDER_DIR],
+        app_kwargs={"middleware": [Middleware(stream_safe_gzip, minimum_size=GZIP_MINIMUM_SIZE)]}
+    )
 
-    print("\n" + "="*50)
-    print("✅ Приложение запущено!")
-    print("🔗 Публичная ссылка (для доступа откуда угодно): найдите в строке выше, она выглядит как https://....gradio.live")
-    print(f"🏠 Локальная ссылка (для этого компьютера): http://127.0.0.1:7862")
-    print("="*50 + "\n")
+    logger.info("✅ Приложение запущено!")
+    logger.info("🔗 Публичная ссылка (для доступа откуда угодно): найдите в строке выше, она выглядит как https://....gradio.live")
+    logger.info("🏠 Локальная ссылка (для этого компьютера): http://127.0.0.1:7862")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,13 @@
-import xml.etree.ElementTree as ET
 import base64
 import zlib
 import urllib.parse
 
+# libxml2-backed parser when available, the stdlib parser otherwise
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
 
 # -*- coding: utf-8 -*-
 """
@@ -39,21 +44,22 @@ def parse_drawio_diagram(file_path):
         # The wbits parameter is set to -15 to handle raw deflate data without zlib header
         decompressed_data = zlib.decompress(decoded_data, -15)
         
-        # 4. URL Decode
-        inner_xml_string = urllib.parse.unquote(decompressed_data.decode('utf-8'))
+        # 4. URL Decode straight to bytes, skipping an intermediate str
+        inner_xml_bytes = urllib.parse.unquote_to_bytes(decompressed_data)
 
         # 5. Parse the inner XML containing the graph model
-        root = ET.fromstring(inner_xml_string)
+        root = ET.fromstring(inner_xml_bytes)
         
         nodes = {}
         edges = {}
 
         # 6. Extract nodes and edges from the inner XML model
-        for cell in root.findall(".//mxCell"):
-            cell_id = cell.get("id")
-            cell_value = cell.get("value")
-            cell_source = cell.get("source")
-            cell_target = cell.get("target")
+        for cell in root.iterfind(".//mxCell"):
+            attrib = cell.attrib
+            cell_id = attrib.get("id")
+            cell_value = attrib.get("value")
+            cell_source = attrib.get("source")
+            cell_target = attrib.get("target")
 
             # It's a node if it has a value and is not an edge.
             # We also ignore the root cells (id 0 and 1) which are containers.
@@ -64,7 +70,7 @@ def parse_drawio_diagram(file_path):
                 if cell_source not in edges:
                     edges[cell_source] = []
                 # Also capture the edge's label if it exists
-                edge_label = cell.get('value', '')
+                edge_label = attrib.get('value', '')
                 edges[cell_source].append({'target': cell_target, 'label': edge_label})
 
         return {"nodes": nodes, "edges": edges}
@@ -127,19 +133,44 @@ def process_feedback(feedback):
     # This might involve another call to Vertex AI with refined instructions.
     return {"data": "path/to/image.jpg_with_feedback"}
 
+# Label keywords that map diagram nodes to agent steps, in matching order
+STEP_START = 'начало'
+STEP_GET_INPUT = 'получить ввод'
+STEP_VERTEX = 'обработать с помощью vertex'
+STEP_RETURN_RESULT = 'вернуть результат'
+STEP_FEEDBACK = 'обработать обратную связь'
+STEP_KEYWORDS = (STEP_START, STEP_GET_INPUT, STEP_VERTEX, STEP_RETURN_RESULT, STEP_FEEDBACK)
+
+def build_label_index(nodes):
+    """
+    Lowercases every label once and returns two lookups:
+    {keyword: id of the first node whose label contains it} and
+    {node_id: first keyword its label contains, or None}.
+    """
+    label_index = {}
+    node_steps = {}
+    for node_id, label in nodes.items():
+        lowered = label.lower()
+        node_steps[node_id] = None
+        for keyword in STEP_KEYWORDS:
+            if keyword in lowered:
+                label_index.setdefault(keyword, node_id)
+                if node_steps[node_id] is None:
+                    node_steps[node_id] = keyword
+    return label_index, node_steps
+
 def find_start_node(nodes):
     """Finds the node with 'Начало' in its label."""
-    for node_id, label in nodes.items():
-        if 'начало' in label.lower():
-            return node_id
-    return None
+    return build_label_index(nodes)[0].get(STEP_START)
 
 def run_agent(diagram):
     """Executes the agent logic based on the parsed diagram."""
     nodes = diagram['nodes']
     edges = diagram['edges']
     
-    start_node_id = find_start_node(nodes)
+    # Labels are matched once up front; each step is then a dict lookup
+    label_index, node_steps = build_label_index(nodes)
+    start_node_id = label_index.get(STEP_START)
     if not start_node_id:
         print("\nERROR: Could not find a starting node in the diagram.")
         return
@@ -153,23 +184,19 @@ def run_agent(diagram):
         print(f"\nExecuting step: {node_label.replace('<br>', ' ')}")
 
         # Map node labels to functions
-        if 'начало' in node_label.lower():
+        step = node_steps.get(current_node_id)
+        if step == STEP_START:
             pass # Starting point
-        elif 'получить ввод' in node_label.lower():
+        elif step == STEP_GET_INPUT:
             agent_data = get_user_input()
-        elif 'обработать с помощью vertex' in node_label.lower():
+        elif step == STEP_VERTEX:
             agent_data = process_with_vertex_ai(agent_data)
-        elif 'вернуть результат' in node_label.lower():
+        elif step == STEP_RETURN_RESULT:
             feedback = return_result_and_get_feedback(agent_data)
             if feedback:
                 # If there is feedback, we need to find the node for processing feedback.
                 # This is a simple implementation. A real one would use edge labels.
-                feedback_node_id = None
-                for target_id, label in nodes.items():
-                    if 'обработать обратную связь' in label.lower():
-                        feedback_node_id = target_id
-                        break
-                current_node_id = feedback_node_id
+                current_node_id = label_index.get(STEP_FEEDBACK)
                 agent_data = feedback # Pass feedback to the next step
                 continue # Skip normal transition
             else:
@@ -177,15 +204,10 @@ def run_agent(diagram):
                 current_node_id = None
                 continue
 
-        elif 'обработать обратную связь' in node_label.lower():
+        elif step == STEP_FEEDBACK:
             agent_data = process_feedback(agent_data)
             # After processing feedback, loop back to Vertex AI processing
-            feedback_loop_target = None
-            for target_id, label in nodes.items():
-                if 'обработать с помощью vertex' in label.lower():
-                    feedback_loop_target = target_id
-                    break
-            current_node_id = feedback_loop_target
+            current_node_id = label_index.get(STEP_VERTEX)
             continue
 
         else:
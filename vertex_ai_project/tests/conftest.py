@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py and src/ live next to this directory and are not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
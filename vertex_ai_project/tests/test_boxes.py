@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def random_boxes(rng, n):
+    """Random corner boxes on a small canvas, so many of them overlap."""
+    corners = rng.integers(0, 60, size=(n, 2))
+    sizes = rng.integers(0, 40, size=(n, 2))
+    return np.hstack([corners, corners + sizes]).astype(np.float64)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_nms_numpy_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    boxes = random_boxes(rng, 40)
+
+    expected = app._nms_keep_loop(boxes, app.DUPLICATE_IOU_THRESHOLD)
+
+    np.testing.assert_array_equal(app._nms_keep_numpy(boxes, app.DUPLICATE_IOU_THRESHOLD), expected)
+    # Whichever implementation is active (numba-compiled loop or NumPy) agrees too
+    np.testing.assert_array_equal(app.nms_keep(boxes, app.DUPLICATE_IOU_THRESHOLD), expected)
+
+
+def test_nms_keeps_first_of_duplicates():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [20, 20, 30, 30]], dtype=np.float64)
+
+    assert app.nms_keep(boxes, 0.7).tolist() == [True, False, True]
+
+
+def test_deduplicate_elements_drops_repeated_boxes():
+    elements = [
+        {"id": 1, "box": [0, 0, 100, 40], "description": "Кнопка"},
+        {"id": 2, "box": [2, 1, 100, 40], "description": "Кнопка (повтор)"},
+        {"id": 3, "box": [0, 50, 100, 90], "description": "Поле ввода"},
+    ]
+
+    assert [element["id"] for element in app.deduplicate_elements(elements)] == [1, 3]
+
+
+def test_deduplicate_elements_keeps_records_without_a_box():
+    elements = [
+        {"id": 1, "box": [0, 0, 10, 10], "description": "a"},
+        {"id": 2, "description": "no box"},
+        {"id": 3, "box": [0, 0, 10, 10], "description": "a again"},
+        "not a record",
+    ]
+
+    assert app.deduplicate_elements(elements) == [elements[0], elements[1], elements[3]]
+
+
+def test_deduplicate_elements_returns_input_when_nothing_to_drop():
+    elements = [{"id": 1, "box": [0, 0, 10, 10]}, {"id": 2, "box": [50, 50, 60, 60]}]
+
+    assert app.deduplicate_elements(elements) is elements
+
+
+def test_extract_boxes_skips_invalid_records():
+    elements = [
+        {"id": 1, "box": [0, 0, 10, 10]},
+        {"id": 2, "box": [1, 2, 3]},
+        {"id": 3},
+        "not a record",
+        {"id": 5, "box": [5, 6, 7, 8]},
+    ]
+
+    indices, boxes = app.extract_boxes(elements)
+
+    assert indices == [0, 4]
+    assert boxes.dtype == np.float64
+    np.testing.assert_array_equal(boxes, [[0, 0, 10, 10], [5, 6, 7, 8]])
+
+
+def test_extract_boxes_empty_is_an_n_by_4_array():
+    indices, boxes = app.extract_boxes([])
+
+    assert indices == []
+    assert boxes.shape == (0, 4)
+
+
+def test_prepare_elements_clips_boxes_to_the_image():
+    elements = [
+        {"id": 1, "box": [-20, -10, 50, 25], "description": "за краем"},
+        {"id": 2, "box": [150, 75, 250, 150], "description": "за краем справа"},
+        {"id": 3, "box": [20, 10, 40, 30], "description": "внутри"},
+    ]
+
+    prepared = app.prepare_elements(elements, 200, 100)
+
+    assert prepared == [
+        (1, 0.0, 0.0, 25.0, 25.0, "за краем"),
+        (2, 75.0, 75.0, 25.0, 25.0, "за краем справа"),
+        (3, 10.0, 10.0, 10.0, 20.0, "внутри"),
+    ]
+
+
+def test_prepare_elements_skips_malformed_records():
+    elements = [
+        {"id": 1, "box": [0, 0, 10, 10]},
+        {"id": 2, "box": [0, 0, 10], "description": "short box"},
+        None,
+        {"box": [0, 0, 20, 20], "description": "no id"},
+    ]
+
+    assert app.prepare_elements(elements, 100, 100) == [("?", 0.0, 0.0, 20.0, 20.0, "no id")]
@@ -0,0 +1,79 @@
+import base64
+import urllib.parse
+import zlib
+
+import app
+
+
+def test_dependency_map_follows_edges():
+    nodes = {"a": "Start", "b": "Step", "c": "Step", "d": "End"}
+    edges = [("a", "b"), ("a", "c"), ("b", "d"), ("c", "d")]
+
+    predecessors = app.build_dependency_map(nodes, edges)
+
+    assert predecessors == {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"]}
+
+
+def test_dependency_map_drops_cycle_closing_edge():
+    nodes = {"a": "Start", "b": "Check", "c": "Retry"}
+    # c -> b loops back and would make b wait for itself
+    edges = [("a", "b"), ("b", "c"), ("c", "b")]
+
+    predecessors = app.build_dependency_map(nodes, edges)
+
+    assert predecessors == {"a": [], "b": ["a"], "c": ["b"]}
+
+
+def test_dependency_map_ignores_edges_to_unknown_nodes():
+    nodes = {"a": "Start", "b": "End"}
+    edges = [("a", "b"), ("a", "missing"), ("missing", "b")]
+
+    assert app.build_dependency_map(nodes, edges) == {"a": [], "b": ["a"]}
+
+
+def test_dependency_map_self_loop_is_ignored():
+    nodes = {"a": "Loop"}
+
+    assert app.build_dependency_map(nodes, [("a", "a")]) == {"a": []}
+
+
+GRAPH_MODEL = (
+    '<mxGraphModel><root>'
+    '<mxCell id="0"/><mxCell id="1" parent="0"/>'
+    '<mxCell id="n1" value="Start" vertex="1" parent="1"/>'
+    '<mxCell id="n2" value="Анализ" vertex="1" parent="1"/>'
+    '<mxCell id="e1" edge="1" source="n1" target="n2" parent="1"/>'
+    '<mxCell id="e2" edge="1" source="n1" parent="1"/>'
+    '</root></mxGraphModel>'
+)
+
+
+def compress_graph_model(xml):
+    """Encodes a graph model the way Draw.io stores compressed diagrams."""
+    compressor = zlib.compressobj(wbits=-15)
+    deflated = compressor.compress(urllib.parse.quote(xml).encode()) + compressor.flush()
+    return base64.b64encode(deflated).decode()
+
+
+def test_parse_drawio_diagram_plain(tmp_path):
+    path = tmp_path / "plain.drawio"
+    path.write_text(f'<mxfile><diagram id="d">{GRAPH_MODEL}</diagram></mxfile>', encoding="utf-8")
+
+    nodes, edges = app.parse_drawio_diagram(str(path))
+
+    assert nodes == {"n1": "Start", "n2": "Анализ"}
+    assert edges == [("n1", "n2")]
+
+
+def test_parse_drawio_diagram_compressed(tmp_path):
+    path = tmp_path / "compressed.drawio"
+    path.write_text(f'<mxfile><diagram id="d">{compress_graph_model(GRAPH_MODEL)}</diagram></mxfile>', encoding="utf-8")
+
+    nodes, edges = app.parse_drawio_diagram(str(path))
+
+    assert nodes == {"n1": "Start", "n2": "Анализ"}
+    assert edges == [("n1", "n2")]
+
+
+def test_parse_drawio_diagram_missing_file(tmp_path):
+    assert app.parse_drawio_diagram(str(tmp_path / "missing.drawio")) == ({}, [])
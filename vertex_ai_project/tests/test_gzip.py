@@ -0,0 +1,52 @@
+import asyncio
+import gzip
+
+import app
+
+SSE_CHUNKS = [b"data: 1\n\n" * 200, b"data: 2\n\n" * 200]
+HTML_BODY = b"<div>x</div>" * 200
+
+
+def fake_app(content_type, chunks, log):
+    async def asgi_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        for i, chunk in enumerate(chunks):
+            log.append(("app", i))
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return asgi_app
+
+
+def serve(content_type, chunks):
+    """Runs one gzip-accepting request; returns the sent messages and the event order."""
+    log = []
+    messages = []
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            log.append(("client", len(messages) - 1))
+        messages.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    middleware = app.stream_safe_gzip(fake_app(content_type, chunks, log), minimum_size=100)
+    asyncio.run(middleware(scope, receive, send))
+    return messages, log
+
+
+def test_event_streams_bypass_gzip():
+    messages, log = serve(b"text/event-stream", SSE_CHUNKS)
+
+    assert b"content-encoding" not in dict(messages[0]["headers"])
+    assert [message["body"] for message in messages[1:]] == SSE_CHUNKS
+    # Each chunk reaches the client before the app produces the next one
+    assert log == [("app", 0), ("client", 0), ("app", 1), ("client", 1)]
+
+
+def test_other_responses_are_gzipped():
+    messages, _ = serve(b"text/html; charset=utf-8", [HTML_BODY])
+
+    assert dict(messages[0]["headers"])[b"content-encoding"] == b"gzip"
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    assert gzip.decompress(body) == HTML_BODY
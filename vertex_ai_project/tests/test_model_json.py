@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import app
+
+RESPONSE = json.dumps({
+    "elements": [
+        {"id": 1, "box": [0, 0, 10, 10], "description": "Кнопка {OK}"},
+        {"id": 2, "box": [5, 5, 20, 20], "description": "Поле \"поиск\""},
+        {"id": 3, "box": [1, 2, 3, 4], "description": "Меню"},
+    ]
+}, ensure_ascii=False, indent=2)
+
+
+def test_parse_partial_elements_complete_response():
+    elements, _ = app.parse_partial_elements(RESPONSE)
+
+    assert elements == json.loads(RESPONSE)["elements"]
+
+
+def test_parse_partial_elements_resumes_on_every_prefix():
+    # Feeding the response one character at a time, resuming from the
+    # returned position, yields every element exactly once
+    elements = []
+    pos = 0
+    for end in range(1, len(RESPONSE) + 1):
+        new_elements, pos = app.parse_partial_elements(RESPONSE[:end], pos)
+        elements.extend(new_elements)
+
+    assert elements == json.loads(RESPONSE)["elements"]
+
+
+def test_parse_partial_elements_waits_for_the_array():
+    assert app.parse_partial_elements('{"eleme') == ([], 0)
+    assert app.parse_partial_elements('{"elements": ') == ([], 0)
+
+
+def test_parse_partial_elements_holds_back_an_incomplete_object():
+    text = '{"elements": [{"id": 1, "box": [0, 0, 1, 1]}, {"id": 2, "desc'
+
+    elements, pos = app.parse_partial_elements(text)
+
+    assert elements == [{"id": 1, "box": [0, 0, 1, 1]}]
+    assert text[pos] == "{"
+
+
+EXPECTED = {"elements": [{"id": 1, "box": [0, 0, 1, 1], "description": "Кнопка"}]}
+
+
+def test_parse_model_json_bare():
+    assert app.parse_model_json(json.dumps(EXPECTED)) == EXPECTED
+
+
+def test_parse_model_json_fenced():
+    text = "```json\n" + json.dumps(EXPECTED, indent=2) + "\n```"
+
+    assert app.parse_model_json(text) == EXPECTED
+
+
+def test_parse_model_json_ignores_surrounding_text():
+    text = "Вот результат:\n" + json.dumps(EXPECTED) + "\nНадеюсь, это поможет."
+
+    assert app.parse_model_json(text) == EXPECTED
+
+
+def test_parse_model_json_rejects_truncated_json():
+    with pytest.raises(json.JSONDecodeError):
+        app.parse_model_json('{"elements": [{"id": 1')
@@ -0,0 +1,33 @@
+import json
+import re
+
+import app
+
+
+def render(elements):
+    prepared = app.prepare_elements(elements, 200, 100)
+    return app.create_interactive_html("/file=screen.webp", (200, 100), prepared)
+
+
+def descriptions_of(html):
+    block = re.search(r'<script type="application/json" id="ui-desc">(.*?)</script>', html, re.S)
+    return json.loads(block.group(1))
+
+
+def test_boxes_are_keyed_by_position():
+    html = render([
+        {"id": 1, "box": [0, 0, 10, 10], "description": "первый"},
+        {"id": 1, "box": [20, 20, 40, 40], "description": "повтор id"},
+    ])
+
+    assert re.findall(r'data-element-id="(\d+)"', html) == ["0", "1"]
+    # Repeated ids keep their own descriptions
+    assert descriptions_of(html) == ["первый", "повтор id"]
+
+
+def test_ids_are_escaped_and_descriptions_cannot_close_the_data_block():
+    html = render([{"id": "<b>1</b>", "box": [0, 0, 10, 10], "description": "</script><script>alert(1)</script>"}])
+
+    assert "<b>1</b>" not in html
+    assert "&lt;b&gt;1&lt;/b&gt;" in html
+    assert descriptions_of(html) == ["</script><script>alert(1)</script>"]
@@ -0,0 +1,61 @@
+import pytest
+from PIL import Image
+
+import app
+
+
+@pytest.mark.parametrize("size, expected", [
+    ((800, 600), (800, 600)),
+    ((1024, 768), (1024, 768)),
+    # Just over the limit: the factor rounds up to 2, not down to 1
+    ((1025, 400), (513, 200)),
+    ((2047, 1000), (1024, 500)),
+    ((2048, 1536), (1024, 768)),
+    ((600, 3000), (200, 1000)),
+])
+def test_reduce_for_analysis_fits_the_longer_side(size, expected):
+    reduced = app.reduce_for_analysis(Image.new("RGB", size))
+
+    assert reduced.size == expected
+    assert max(reduced.size) <= app.MAX_ANALYSIS_SIDE
+
+
+def test_reduce_for_analysis_returns_small_images_unchanged():
+    image = Image.new("RGB", (100, 100))
+
+    assert app.reduce_for_analysis(image) is image
+
+
+def test_reduce_for_analysis_converts_palette_images():
+    reduced = app.reduce_for_analysis(Image.new("P", (2000, 100)))
+
+    assert reduced.mode == "RGBA"
+    assert reduced.size == (1000, 50)
+
+
+def test_restore_box_scale_maps_boxes_to_the_original():
+    response = {"elements": [
+        {"id": 1, "box": [10, 20, 30, 40], "description": "a"},
+        {"id": 2, "description": "no box"},
+        {"id": 3, "box": [0, 0, 513, 200], "description": "b"},
+    ]}
+
+    restored = app.restore_box_scale(response, (513, 200), (1025, 400))
+
+    assert [element.get("box") for element in restored["elements"]] == [[20, 40, 60, 80], None, [0, 0, 1025, 400]]
+    assert all(isinstance(value, int) for value in restored["elements"][0]["box"])
+
+
+def test_restore_box_scale_leaves_the_input_untouched():
+    response = {"elements": [{"id": 1, "box": [10, 10, 20, 20]}]}
+
+    restored = app.restore_box_scale(response, (100, 100), (200, 200))
+
+    assert response == {"elements": [{"id": 1, "box": [10, 10, 20, 20]}]}
+    assert restored["elements"][0]["box"] == [20, 20, 40, 40]
+
+
+def test_restore_box_scale_same_size_is_a_no_op():
+    response = {"elements": [{"id": 1, "box": [1, 2, 3, 4]}]}
+
+    assert app.restore_box_scale(response, (100, 50), (100, 50)) is response
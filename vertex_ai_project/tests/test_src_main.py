@@ -0,0 +1,96 @@
+import base64
+import importlib.util
+import os
+import sys
+import urllib.parse
+import xml.etree.ElementTree
+import zlib
+
+import pytest
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "main.py")
+
+GRAPH_MODEL = (
+    '<mxGraphModel><root>'
+    '<mxCell id="0"/><mxCell id="1" parent="0"/>'
+    '<mxCell id="n1" value="Начало" vertex="1" parent="1"/>'
+    '<mxCell id="n2" value="Получить ввод" vertex="1" parent="1"/>'
+    '<mxCell id="e1" value="далее" edge="1" source="n1" target="n2" parent="1"/>'
+    '</root></mxGraphModel>'
+)
+
+
+def load_main(monkeypatch, block_lxml):
+    """Loads a fresh copy of src/main.py, optionally as if lxml weren't installed."""
+    if block_lxml:
+        # A None entry makes "from lxml import etree" raise ImportError
+        monkeypatch.setitem(sys.modules, "lxml", None)
+    spec = importlib.util.spec_from_file_location("src_main_under_test", MAIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["lxml", "stdlib"])
+def main_module(request, monkeypatch):
+    if request.param == "lxml":
+        pytest.importorskip("lxml")
+    module = load_main(monkeypatch, block_lxml=request.param == "stdlib")
+    assert (module.ET is xml.etree.ElementTree) == (request.param == "stdlib")
+    return module
+
+
+def write_diagram(tmp_path, xml):
+    compressor = zlib.compressobj(wbits=-15)
+    deflated = compressor.compress(urllib.parse.quote(xml).encode()) + compressor.flush()
+    path = tmp_path / "flow.drawio"
+    path.write_text(f'<mxfile><diagram id="d">{base64.b64encode(deflated).decode()}</diagram></mxfile>', encoding="utf-8")
+    return str(path)
+
+
+def test_parse_drawio_diagram(main_module, tmp_path):
+    diagram = main_module.parse_drawio_diagram(write_diagram(tmp_path, GRAPH_MODEL))
+
+    assert diagram == {
+        "nodes": {"n1": "Начало", "n2": "Получить ввод"},
+        "edges": {"n1": [{"target": "n2", "label": "далее"}]},
+    }
+
+
+def test_parse_drawio_diagram_without_diagram_text(main_module, tmp_path):
+    path = tmp_path / "empty.drawio"
+    path.write_text('<mxfile><diagram id="d"/></mxfile>', encoding="utf-8")
+
+    assert main_module.parse_drawio_diagram(str(path)) is None
+
+
+def test_parse_drawio_diagram_missing_file(main_module, tmp_path):
+    assert main_module.parse_drawio_diagram(str(tmp_path / "missing.drawio")) is None
+
+
+def test_build_label_index(monkeypatch):
+    main = load_main(monkeypatch, block_lxml=False)
+    nodes = {
+        "n1": "Начало",
+        "n2": "Получить ввод<br>от пользователя",
+        "n3": "ОБРАБОТАТЬ С ПОМОЩЬЮ VERTEX AI",
+        "n4": "Получить ввод ещё раз",
+        "n5": "Конец",
+    }
+
+    label_index, node_steps = main.build_label_index(nodes)
+
+    # Matching is case-insensitive and the first node with a keyword wins
+    assert label_index == {
+        main.STEP_START: "n1",
+        main.STEP_GET_INPUT: "n2",
+        main.STEP_VERTEX: "n3",
+    }
+    assert node_steps == {
+        "n1": main.STEP_START,
+        "n2": main.STEP_GET_INPUT,
+        "n3": main.STEP_VERTEX,
+        "n4": main.STEP_GET_INPUT,
+        "n5": None,
+    }
+    assert main.find_start_node(nodes) == "n1"